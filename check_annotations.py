@@ -1,14 +1,13 @@
 import numpy as np
-import skimage.measure
-import zarr
+import config
 
-dataset = '20210722'
-original_dataset = '../data/source_data'
-assignments = ['c0', 'c1', 'c2', 'c3', 'c4']
-max_num_chunks = 20
 layer_names = ['vesicles', 'cleft', 'cleft_membrane', 'cytosol', 'posts', 't-bars']
 
-background_width = 50  # the space between individual synapses in the source data
+# settings used by the functions below, overwritten from the command line (see
+# config.py)
+original_dataset = config.get_default('original_dataset')
+# the space between individual synapses in the source data
+background_width = config.get_default('background_width')
 
 
 def check_chunk(zarr_file, chunk_group):
@@ -101,6 +100,8 @@ def find_excess_labels(zarr_file, synapse_group):
 
 def compare_intensities(zarr_file, synapse_group):
 
+    import zarr
+
     # synapse_group: synapses_c0_0/0
     #   split into: chunk_group / synapse_number
 
@@ -134,6 +135,8 @@ def has_unique_connected_components(layer):
     '''This function checks whether each connected component in the given numpy
     array has a unique ID.'''
 
+    import skimage.measure
+
     ### Step 1: generate a binary mask ###
 
     unique_labels, label_counts = np.unique(layer, return_counts=True)
@@ -189,15 +192,24 @@ def has_annotations(layer):
 
 if __name__ == "__main__":
 
-    zarr_file = zarr.open(f'../data/{dataset}.zarr', 'r')
+    parser = config.create_parser(
+        "Check the annotations of all synapses for common mistakes.")
+    # c0, c1, and c2 have been checked already
+    args = config.parse_config(
+        parser,
+        script_defaults={'skip_assignments': ['c0', 'c1', 'c2']})
+
+    original_dataset = args.original_dataset
+    background_width = args.background_width
+
+    zarr_file = config.open_dataset(args)
 
-    for assignment in assignments:
+    for assignment in args.assignments:
 
-        # already checked
-        if assignment in ['c0', 'c1', 'c2']:
+        if assignment in args.skip_assignments:
             continue
 
-        for chunk in range(max_num_chunks):
+        for chunk in range(args.max_num_chunks):
 
             chunk_group = f'synapses_{assignment}_{chunk}'
 
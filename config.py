@@ -0,0 +1,181 @@
+import argparse
+import json
+
+# default values for all settings, can be overwritten with a JSON config file
+# (passed with --config) and individual command line flags
+#
+# "{data_dir}" in paths is replaced with the value of `data_dir`, such that
+# these paths follow --data-dir unless they are set explicitly
+defaults = {
+    'dataset': '20210722',
+    'data_dir': '../data',
+    'file_to_ids_json': '{data_dir}/source_data/file_to_ids.json',
+    'ids_to_nt_json': '{data_dir}/source_data/ids_to_nt.json',
+    'original_dataset': '{data_dir}/source_data',
+    'assignments': ['c0', 'c1', 'c2', 'c3', 'c4'],
+    'assignment_to_annotator': {
+        'c0': 'a0',
+        'c1': 'a1',
+        'c2': 'a2',
+        'c3': 'a2',
+        'c4': 'a2',
+    },
+    'max_num_chunks': 20,
+    'background_width': 50,
+    'skip_assignments': [],
+    'cache_dir': None,
+    'max_cache_size': 10*1024**3,
+}
+
+
+def get_default(key):
+    '''Get the default value of a setting, with "{data_dir}" replaced.'''
+
+    return expand_data_dir(defaults[key], defaults['data_dir'])
+
+
+def expand_data_dir(value, data_dir):
+
+    if isinstance(value, str):
+        return value.replace('{data_dir}', data_dir)
+
+    return value
+
+
+def parse_key_value(key_value):
+
+    key, sep, value = key_value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(
+            f"expected <key>=<value>, got '{key_value}'")
+
+    return key, value
+
+
+def create_parser(description):
+    '''Create an argument parser with flags for all settings in `defaults`.
+
+    The values of `defaults` are set in `parse_config`.'''
+
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument(
+        '--config',
+        help="JSON file with settings, flags take precedence over this file")
+    parser.add_argument(
+        '--dataset',
+        help="name of the dataset, read from <data_dir>/<dataset>.zarr")
+    parser.add_argument(
+        '--data-dir',
+        help="directory containing the datasets")
+    parser.add_argument(
+        '--file-to-ids-json',
+        help="JSON file mapping chunks to synapse IDs (default "
+             "<data_dir>/source_data/file_to_ids.json)")
+    parser.add_argument(
+        '--ids-to-nt-json',
+        help="JSON file mapping synapse IDs to neurotransmitters (default "
+             "<data_dir>/source_data/ids_to_nt.json)")
+    parser.add_argument(
+        '--original-dataset',
+        help="directory containing the source chunks (default "
+             "<data_dir>/source_data)")
+    parser.add_argument(
+        '--assignments',
+        nargs='+',
+        help="assignments to process")
+    parser.add_argument(
+        '--assignment-to-annotator',
+        nargs='+',
+        type=parse_key_value,
+        metavar='ASSIGNMENT=ANNOTATOR',
+        help="annotator of an assignment, added to (or overwriting) the "
+             "mapping of the config file or the default one")
+    parser.add_argument(
+        '--max-num-chunks',
+        type=int,
+        help="maximal number of chunks per assignment")
+    parser.add_argument(
+        '--background-width',
+        type=int,
+        help="the space between individual synapses in the source data")
+    parser.add_argument(
+        '--skip-assignments',
+        nargs='*',
+        help="assignments to skip (e.g., because they have been checked "
+             "already)")
+    parser.add_argument(
+        '--cache-dir',
+        help="keep uncompressed, memory-mapped copies of all layers in this "
+             "directory (see synapse_cache.py)")
+    parser.add_argument(
+        '--max-cache-size',
+        type=int,
+        help="maximal size of the cache in bytes")
+
+    return parser
+
+
+def parse_config(parser, args=None, script_defaults=None):
+    '''Parse the command line and merge it with the config file (if given) and
+    `defaults`.
+
+    Script-specific flags added to `parser` can be set in the config file as
+    well, their defaults are the ones given to `parser.add_argument`.
+
+    `script_defaults` overwrites values of `defaults` for a single script
+    (e.g., which assignments to skip), the config file and flags take
+    precedence over them.
+
+    Returns an `argparse.Namespace` with all settings.'''
+
+    parser.set_defaults(**defaults)
+    if script_defaults is not None:
+        parser.set_defaults(**script_defaults)
+    known_args, _ = parser.parse_known_args(args)
+
+    assignment_to_annotator = dict(
+        parser.get_default('assignment_to_annotator'))
+
+    if known_args.config is not None:
+        with open(known_args.config, 'r') as f:
+            config_file = json.load(f)
+        for key in config_file:
+            if key not in vars(known_args):
+                raise RuntimeError(
+                    f"unknown setting '{key}' in {known_args.config}")
+        assignment_to_annotator = dict(config_file.pop(
+            'assignment_to_annotator',
+            assignment_to_annotator))
+        parser.set_defaults(**config_file)
+
+    # pairs given with --assignment-to-annotator are added to the mapping of
+    # the config file (or the default one), instead of replacing it
+    parser.set_defaults(assignment_to_annotator=None)
+
+    config = parser.parse_args(args)
+    if config.assignment_to_annotator is not None:
+        assignment_to_annotator.update(config.assignment_to_annotator)
+    config.assignment_to_annotator = assignment_to_annotator
+
+    for key, value in vars(config).items():
+        setattr(config, key, expand_data_dir(value, config.data_dir))
+
+    return config
+
+
+def open_dataset(config):
+    '''Open the zarr container of the configured dataset, or a cache of it if
+    `cache_dir` is set.'''
+
+    zarr_path = f'{config.data_dir}/{config.dataset}.zarr'
+
+    if config.cache_dir is None:
+        import zarr
+        return zarr.open(zarr_path, 'r')
+
+    from synapse_cache import SynapseCache
+    return SynapseCache(
+        zarr_path,
+        f'{config.cache_dir}/{config.dataset}',
+        config.max_cache_size)
@@ -1,24 +1,17 @@
 import numpy as np
-import skimage.measure
-import zarr
 import json
 import math
+import os
 import sys
 import random
+import time
+import config
 
-dataset = '20210722'
-file_to_ids_json = "../data/source_data/file_to_ids.json"
-ids_to_nt_json = "../data/source_data/ids_to_nt.json"
-assignments = ['c0', 'c1', 'c2', 'c3', 'c4']
-annotators = ['a0', 'a1', 'a2']
-assignment_to_annotator = {
-    'c0': 'a0',
-    'c1': 'a1',
-    'c2': 'a2',
-    'c3': 'a2',
-    'c4': 'a2',
-}
-max_num_chunks = 20
+# settings used by the functions below, overwritten from the command line (see
+# config.py)
+file_to_ids_json = config.get_default('file_to_ids_json')
+ids_to_nt_json = config.get_default('ids_to_nt_json')
+assignment_to_annotator = config.get_default('assignment_to_annotator')
 
 file_to_ids = None
 ids_to_nt = None
@@ -156,6 +149,8 @@ def extract_vesicle_sizes(zarr_file, synapse_group):
 
 def extract_vesicle_eccentricities(zarr_file, synapse_group):
 
+    import skimage.measure
+
     vesicle_eccentricities = []
 
     ds_name = f"{synapse_group}/{'vesicles'}"
@@ -275,9 +270,127 @@ def assign_number_to_duplicates(synapse_features):
         for i, p in zip(indices, numbers):
             synapse_features[i]['duplicate_number'] = p
 
+def get_chunk_groups(zarr_file, assignments, max_num_chunks):
+    '''Get the names of all chunk groups in the zarr container, in the order
+    in which they should appear in the output.'''
+
+    chunk_groups = []
+
+    for assignment in assignments:
+
+        for chunk in range(max_num_chunks):
+
+            chunk_group = f'synapses_{assignment}_{chunk}'
+
+            if chunk_group not in zarr_file:
+                continue
+
+            chunk_groups.append(chunk_group)
+
+    return chunk_groups
+
+def run_worker(zarr_file, queue, shard_dir, poll_interval=10):
+    '''Process chunk groups claimed from `queue` until all of them are done
+    (or failed too often), and store the features of each in
+    `<shard_dir>/<chunk_group>.json`.
+
+    While other workers hold claims, this keeps polling the queue, such that
+    chunk groups of crashed workers are processed again once their claim
+    times out.'''
+
+    while True:
+
+        chunk_group = queue.claim()
+
+        if chunk_group is None:
+
+            wait_time = queue.get_wait_time()
+            if wait_time is None:
+                break
+
+            # wake up earlier to pick up chunk groups released by other
+            # workers after a failure
+            time.sleep(min(max(wait_time, 0.1), poll_interval))
+            continue
+
+        print(f"Processing chunk {chunk_group}...")
+
+        try:
+            chunk_features = process_chunk(zarr_file, chunk_group)
+        except Exception as e:
+            print(f"Processing chunk {chunk_group} failed: {e!r}")
+            queue.failed(chunk_group, repr(e))
+            continue
+
+        # write to a temporary file first, such that a crashing worker does
+        # not leave a partial shard behind
+        shard_file = f'{shard_dir}/{chunk_group}.json'
+        tmp_file = f'{shard_file}.{queue.worker_id}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(chunk_features, f)
+        os.replace(tmp_file, shard_file)
+
+        queue.done(chunk_group)
+
+def merge_shards(queue, shard_dir):
+    '''Concatenate the features of all shards in canonical order.'''
+
+    if not queue.get_status():
+        raise RuntimeError(
+            f"No chunks in the work queue in {shard_dir}, has the extraction "
+            "been run with this --shard-dir?")
+
+    chunk_groups = queue.get_done()
+
+    if chunk_groups is None:
+        for chunk_group, error in queue.get_errors():
+            print(f"{chunk_group}: {error}")
+        raise RuntimeError(
+            f"Not all chunks have been processed: {queue.get_status()}")
+
+    synapse_features = []
+    for chunk_group in chunk_groups:
+        with open(f'{shard_dir}/{chunk_group}.json', 'r') as f:
+            synapse_features += json.load(f)
+
+    return synapse_features
+
 if __name__ == "__main__":
 
-    zarr_file = zarr.open(f'../data/{dataset}.zarr', 'r')
+    parser = config.create_parser(
+        "Extract features of all annotated synapses.")
+    parser.add_argument(
+        '--shard-dir',
+        help="run as one of several workers, which share a work queue and "
+             "write per-chunk results to this directory")
+    parser.add_argument(
+        '--merge',
+        action='store_true',
+        help="merge the results in --shard-dir into the final JSON file")
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=3600,
+        help="seconds after which a chunk claimed by a worker is processed "
+             "again")
+    parser.add_argument(
+        '--max-attempts',
+        type=int,
+        default=3,
+        help="how often to try processing a chunk before giving up")
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=10,
+        help="seconds between checks for chunks released by other workers")
+    args = config.parse_config(parser)
+
+    if args.merge and args.shard_dir is None:
+        parser.error("--merge requires --shard-dir")
+
+    file_to_ids_json = args.file_to_ids_json
+    ids_to_nt_json = args.ids_to_nt_json
+    assignment_to_annotator = args.assignment_to_annotator
 
     # what we want:
     #
@@ -296,22 +409,57 @@ if __name__ == "__main__":
     #          (...and a few more later)
     #   }
 
-    synapse_features = []
+    assignments = [
+        assignment
+        for assignment in args.assignments
+        if assignment not in args.skip_assignments
+    ]
 
-    for assignment in assignments:
+    if args.shard_dir is None:
 
-        for chunk in range(max_num_chunks):
+        zarr_file = config.open_dataset(args)
 
-            chunk_group = f'synapses_{assignment}_{chunk}'
+        synapse_features = []
 
-            if chunk_group not in zarr_file:
-                continue
+        for chunk_group in get_chunk_groups(
+                zarr_file,
+                assignments,
+                args.max_num_chunks):
 
             print(f"Processing chunk {chunk_group}...")
 
             synapse_features += process_chunk(zarr_file, chunk_group)
 
+    else:
+
+        from work_queue import WorkQueue
+
+        os.makedirs(args.shard_dir, exist_ok=True)
+        queue = WorkQueue(
+            f'{args.shard_dir}/queue.sqlite',
+            args.timeout,
+            args.max_attempts)
+
+        if not args.merge:
+
+            zarr_file = config.open_dataset(args)
+
+            queue.add(get_chunk_groups(
+                zarr_file,
+                assignments,
+                args.max_num_chunks))
+            run_worker(
+                zarr_file,
+                queue,
+                args.shard_dir,
+                args.poll_interval)
+
+            print(f"No chunks left to claim: {queue.get_status()}")
+            sys.exit(0)
+
+        synapse_features = merge_shards(queue, args.shard_dir)
+
     assign_number_to_duplicates(synapse_features)
 
-    with open(f'synapse_features_{dataset}.json', 'w') as f:
+    with open(f'synapse_features_{args.dataset}.json', 'w') as f:
         json.dump(synapse_features, f, indent=2)
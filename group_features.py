@@ -1,8 +1,7 @@
-import numpy as np
 import json
-import copy
+import config
 
-dataset = '20210722'
+default_dataset = config.get_default('dataset')
 
 
 def filter_synapses(features, feature_name):
@@ -111,7 +110,161 @@ def group_features(features, feature_name, group_condition):
     # print('grouped_features: ', '\n', f'{grouped_features}')
     return grouped_features
 
-def group_features_by_conditions(condition, filter='unique'):
+def summarize_features(
+        feature_values_by_condition,
+        bins=40,
+        quantiles=(0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0)):
+    '''Summarize the values of one feature per condition.
+
+    All conditions share the same histogram bins, which span the range of all
+    values. Returns a dictionary that looks like:
+
+    ```
+    {
+        'bin_edges': [...],  # bins + 1 edges
+        'quantile_levels': [0.0, 0.05, ...],
+        'groups': {
+            <condition_1>: {
+                'count': ...,
+                'mean': ...,
+                'variance': ...,  # population variance, like np.var
+                'quantiles': [...],  # one per quantile level
+                'histogram': [...]  # number of values per bin
+            },
+            ...
+        }
+    }
+    ```
+    '''
+
+    import numpy as np
+
+    conditions = list(feature_values_by_condition.keys())
+    num_conditions = len(conditions)
+
+    values = [
+        np.asarray(feature_values_by_condition[c], dtype=np.float64)
+        for c in conditions
+    ]
+    counts = np.array([len(v) for v in values], dtype=np.int64)
+
+    if num_conditions == 0 or counts.sum() == 0:
+        return {
+            'bin_edges': [],
+            'quantile_levels': list(quantiles),
+            'groups': {}
+        }
+
+    # one flat array of all values, and the index of the condition of each
+    all_values = np.concatenate(values)
+    condition_index = np.repeat(np.arange(num_conditions), counts)
+
+    # same bins as np.histogram, the last bin includes the right edge
+    bin_edges = np.histogram_bin_edges(
+        all_values,
+        bins=bins,
+        range=(all_values.min(), all_values.max()))
+    bin_index = np.searchsorted(bin_edges, all_values, side='right') - 1
+    bin_index = np.clip(bin_index, 0, bins - 1)
+
+    histograms = np.bincount(
+        condition_index*bins + bin_index,
+        minlength=num_conditions*bins).reshape(num_conditions, bins)
+
+    sums = np.bincount(
+        condition_index,
+        weights=all_values,
+        minlength=num_conditions)
+    means = sums/counts
+    squared_deviations = np.bincount(
+        condition_index,
+        weights=(all_values - means[condition_index])**2,
+        minlength=num_conditions)
+    variances = squared_deviations/counts
+
+    groups = {}
+    for i, condition in enumerate(conditions):
+        groups[condition] = {
+            'count': int(counts[i]),
+            'mean': float(means[i]),
+            'variance': float(variances[i]),
+            'quantiles': [float(q) for q in np.quantile(values[i], quantiles)],
+            'histogram': [int(h) for h in histograms[i]]
+        }
+
+    return {
+        'bin_edges': [float(e) for e in bin_edges],
+        'quantile_levels': list(quantiles),
+        'groups': groups
+    }
+
+
+def ttest_from_summaries(group_summary_1, group_summary_2):
+    '''Perform the same two-sided t-test as `scipy.stats.ttest_ind` (assuming
+    equal variances) on two group summaries of `summarize_features`.
+
+    Returns the t-statistic and p-value.'''
+
+    import math
+    from scipy.stats import ttest_ind_from_stats
+
+    def sample_std(group_summary):
+        # ttest_ind uses the sample variance (ddof=1)
+        n = group_summary['count']
+        if n < 2:
+            return math.nan
+        return math.sqrt(group_summary['variance']*n/(n - 1))
+
+    t_statistic, p_value = ttest_ind_from_stats(
+        group_summary_1['mean'], sample_std(group_summary_1),
+        group_summary_1['count'],
+        group_summary_2['mean'], sample_std(group_summary_2),
+        group_summary_2['count'])
+
+    return t_statistic, p_value
+
+
+def save_summaries(summaries, filename):
+    '''Store the summaries returned by `group_features_by_conditions(...,
+    summarize=True)` in a JSON file.'''
+
+    # JSON keys have to be strings, conditions are stored as "c0,gaba"
+    summaries = {
+        feature_name: dict(
+            feature_summary,
+            groups={
+                ','.join(condition): group_summary
+                for condition, group_summary
+                in feature_summary['groups'].items()
+            })
+        for feature_name, feature_summary in summaries.items()
+    }
+
+    with open(filename, 'w') as f:
+        json.dump(summaries, f, indent=2)
+
+
+def load_summaries(filename):
+    '''Read summaries stored with `save_summaries`.'''
+
+    with open(filename, 'r') as f:
+        summaries = json.load(f)
+
+    for feature_summary in summaries.values():
+        feature_summary['groups'] = {
+            tuple(condition.split(',')): group_summary
+            for condition, group_summary in feature_summary['groups'].items()
+        }
+
+    return summaries
+
+
+def group_features_by_conditions(
+        condition,
+        filter='unique',
+        dataset=None,
+        summarize=False,
+        bins=40):
     '''
     Group synapse features by different conditions.
 
@@ -132,6 +285,21 @@ def group_features_by_conditions(condition, filter='unique'):
 
                 "all": All synpases (including duplicates).
 
+        dataset (string, optional):
+
+            The name of the dataset to read the features of. Defaults to
+            `default_dataset`.
+
+        summarize (bool, optional):
+
+            If set, return a summary (histogram, quantiles, mean, variance,
+            and count) of the values per condition instead of the values
+            themselves, see `summarize_features`.
+
+        bins (int, optional):
+
+            The number of histogram bins to use if `summarize` is set.
+
 
     Returns a dictionary that looks like:
 
@@ -193,6 +361,9 @@ def group_features_by_conditions(condition, filter='unique'):
     ```
     '''
 
+    if dataset is None:
+        dataset = default_dataset
+
     # handle full features
     with open(f"synapse_features_{dataset}.json", 'r') as f:
         features = json.load(f)
@@ -234,5 +405,55 @@ def group_features_by_conditions(condition, filter='unique'):
         for feature_name in feature_names
     }
 
+    if summarize:
+        grouped_features = {
+            feature_name: summarize_features(feature_values_by_condition, bins)
+            for feature_name, feature_values_by_condition
+            in grouped_features.items()
+        }
+
     return grouped_features
 
+
+
+if __name__ == "__main__":
+
+    parser = config.create_parser(
+        "Group the extracted features and report the number of values per "
+        "group.")
+    parser.add_argument(
+        '--condition',
+        nargs='+',
+        default=['by_nt_types'],
+        choices=['by_nt_types', 'by_annotators'],
+        help="conditions to group by")
+    parser.add_argument(
+        '--filter',
+        default='unique',
+        choices=['unique', 'same', 'all'],
+        help="which synapses to include")
+    parser.add_argument(
+        '--summary',
+        help="store a summary of the values per group in this JSON file")
+    parser.add_argument(
+        '--bins',
+        type=int,
+        default=40,
+        help="number of histogram bins for --summary")
+    args = config.parse_config(parser)
+
+    summaries = group_features_by_conditions(
+        tuple(args.condition),
+        args.filter,
+        args.dataset,
+        summarize=True,
+        bins=args.bins)
+
+    if args.summary is not None:
+        save_summaries(summaries, args.summary)
+
+    for feature_name, feature_summary in summaries.items():
+        print(f"{feature_name}:")
+        for feature_condition, group_summary in \
+                feature_summary['groups'].items():
+            print(f"  {feature_condition}: n={group_summary['count']}")
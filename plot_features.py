@@ -0,0 +1,144 @@
+import itertools
+from group_features import ttest_from_summaries
+
+# Plotting and testing helpers that work on feature summaries (see
+# `group_features.summarize_features`), instead of the raw feature values.
+# Their cost depends only on the number of bins and conditions.
+#
+# This module can be used in a jupyter notebook:
+#
+# ```
+# from group_features import group_features_by_conditions
+# from plot_features import plot_histogram, conduct_t_test
+#
+# summaries = group_features_by_conditions(('by_nt_types',), summarize=True)
+# for feature_name, feature_summary in summaries.items():
+#     conduct_t_test(feature_summary)
+#     plot_histogram(feature_name, ('by_nt_types',), feature_summary)
+# ```
+
+
+def get_quantile(feature_summary, group_summary, level):
+
+    levels = feature_summary['quantile_levels']
+    if level not in levels:
+        raise RuntimeError(
+            f"quantile {level} not in summary, available are {levels}")
+
+    return group_summary['quantiles'][levels.index(level)]
+
+
+def plot_histogram(feature_name, condition, feature_summary):
+
+    import matplotlib.pyplot as plt
+
+    bin_edges = feature_summary['bin_edges']
+    bin_widths = [
+        right - left
+        for left, right in zip(bin_edges[:-1], bin_edges[1:])
+    ]
+
+    for feature_condition, group_summary in feature_summary['groups'].items():
+
+        # normalize like plt.hist(..., density=True)
+        count = group_summary['count']
+        density = [
+            h/(count*w)
+            for h, w in zip(group_summary['histogram'], bin_widths)
+        ]
+
+        plt.hist(bin_edges[:-1], bins=bin_edges, weights=density,
+                 label=feature_condition, alpha=0.3)
+
+        print(f"{feature_condition} mean: {group_summary['mean']}")
+        print(f"{feature_condition} stddev: {group_summary['variance']**0.5}")
+
+    plt.title(f'{feature_name} {condition}')
+    plt.legend()
+    plt.show()
+
+
+def conduct_t_test(feature_summary):
+
+    groups = feature_summary['groups']
+
+    # e.g. [('c0', 'c1'), ('c0', 'c2'),('c1', 'c2')]
+    condition_pairs_to_compare = list(itertools.combinations(groups.keys(), 2))
+
+    for pair in condition_pairs_to_compare:
+
+        t_statistic, p_value = ttest_from_summaries(
+            groups[pair[0]],
+            groups[pair[1]])
+
+        print(f'Compare {pair[0]} and {pair[1]}: t-statistics = '
+              f'{t_statistic}, p-value = {p_value}')
+
+
+def add_stat_annotation(ax, group_summaries, x1, x2, y, h):
+
+    _, p = ttest_from_summaries(group_summaries[x1 - 1], group_summaries[x2 - 1])
+
+    text_offset = 0.6
+    if p >= 0.05:
+        significance = 'n.s.'
+        text_offset = 1.5
+    elif p < 0.0001:
+        significance = '***'
+    elif p < 0.001:
+        significance = '**'
+    else:
+        significance = '*'
+
+    ax.plot([x1, x1, x2, x2], [y, y + h, y + h, y], lw=1.5, color='black')
+    ax.text((x1 + x2)*0.5, y + h*text_offset, significance, ha='center',
+            va='bottom')
+
+
+def box_plot(feature_name, feature_summary, filename=None):
+    '''Plot the 5%, 25%, 50%, 75%, and 95% quantiles and the mean of each
+    condition, and annotate the significance of the differences between
+    neighboring conditions.'''
+
+    import matplotlib.pyplot as plt
+
+    conditions = list(feature_summary['groups'].keys())
+    group_summaries = [feature_summary['groups'][c] for c in conditions]
+
+    stats = []
+    for condition, group_summary in zip(conditions, group_summaries):
+        stats.append({
+            'label': ",".join(condition) + f" (n={group_summary['count']})",
+            'whislo': get_quantile(feature_summary, group_summary, 0.05),
+            'q1': get_quantile(feature_summary, group_summary, 0.25),
+            'med': get_quantile(feature_summary, group_summary, 0.5),
+            'q3': get_quantile(feature_summary, group_summary, 0.75),
+            'whishi': get_quantile(feature_summary, group_summary, 0.95),
+            'mean': group_summary['mean']
+        })
+
+    max_value = max(
+        get_quantile(feature_summary, group_summary, 1.0)
+        for group_summary in group_summaries)
+
+    ax = plt.subplot(1, 1, 1)
+
+    ax.bxp(stats, showmeans=True, showfliers=False)
+
+    ax.xaxis.set_tick_params(direction='out')
+    ax.xaxis.set_ticks_position('bottom')
+    ax.set_xlim(0.25, len(stats) + 0.75)
+    ax.set_ylabel(feature_name)
+
+    # annotate neighboring pairs, and the first and last condition
+    for x in range(1, len(stats)):
+        add_stat_annotation(ax, group_summaries, x, x + 1,
+                            max_value*1.2, max_value*0.01)
+    if len(stats) > 2:
+        add_stat_annotation(ax, group_summaries, 1, len(stats),
+                            max_value*1.1, max_value*0.01)
+
+    if filename is not None:
+        plt.savefig(filename, dpi=600)
+
+    plt.show()
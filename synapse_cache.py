@@ -0,0 +1,255 @@
+import numpy as np
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+
+class SynapseCache:
+    '''Read-through cache for the datasets of a zarr container.
+
+    Every dataset that is accessed through this cache is decompressed once
+    and stored as an uncompressed `.npy` file in `cache_dir`. Subsequent
+    accesses (also in later runs) memory-map this file, such that reading a
+    layer does not involve any decompression or copies.
+
+    Cache entries are keyed on a fingerprint of the source chunk files (name,
+    size, and modification time), such that a change of the source data
+    invalidates the cached copy. If the cache grows beyond `max_size` bytes,
+    the least recently used entries are evicted.
+
+    The entries of the cache directory are scanned once on construction and
+    then tracked in memory. The directory is only scanned again (to account
+    for entries written by other processes) once the tracked size exceeds
+    `max_size`.
+
+    The cache can be used in place of the zarr container in all functions of
+    `extract_features.py`:
+
+    ```
+    zarr_file = SynapseCache('../data/20210722.zarr', 'cache')
+    layer = zarr_file['synapses_c0_0/0/vesicles'][:]
+    ```
+
+    Args:
+
+        zarr_path (string):
+
+            Path to the zarr container (has to be a directory store).
+
+        cache_dir (string):
+
+            Directory to store the uncompressed copies in.
+
+        max_size (int, optional):
+
+            Maximal size of the cache in bytes (default 10GB).
+
+        max_tmp_age (float, optional):
+
+            Temporary files older than this many seconds are considered
+            leftovers of crashed processes and removed during eviction.
+    '''
+
+    def __init__(
+            self,
+            zarr_path,
+            cache_dir,
+            max_size=10*1024**3,
+            max_tmp_age=3600):
+
+        import zarr
+
+        self.zarr_path = zarr_path
+        self.zarr_file = zarr.open(zarr_path, 'r')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_tmp_age = max_tmp_age
+
+        # the source data does not change during a run, remember fingerprints
+        self.fingerprints = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # path to size of all entries, least recently used first
+        self.entries = {}
+        self.total_size = 0
+        self.scan()
+
+    def __contains__(self, ds_name):
+
+        return ds_name in self.zarr_file
+
+    def __getitem__(self, ds_name):
+
+        cache_file = self.get_cache_file(ds_name)
+
+        try:
+            layer = np.load(cache_file, mmap_mode='r')
+        except FileNotFoundError:
+            # not cached yet, or evicted by another process
+            layer = None
+
+        if layer is not None:
+
+            # mark as recently used, also for other processes
+            try:
+                os.utime(cache_file)
+            except FileNotFoundError:
+                # evicted in the meantime, the memory-map stays valid
+                pass
+            if cache_file in self.entries:
+                self.entries[cache_file] = self.entries.pop(cache_file)
+
+            return layer
+
+        self.remove_stale_entries(ds_name, keep=cache_file)
+
+        data = self.zarr_file[ds_name][:]
+
+        # write to a unique temporary file first, so that concurrent readers
+        # (also on other hosts) never see partially written entries
+        fd, tmp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_file, cache_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        self.add_entry(cache_file, os.path.getsize(cache_file))
+
+        if self.total_size > self.max_size:
+            self.evict(keep=cache_file)
+
+        try:
+            return np.load(cache_file, mmap_mode='r')
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            return data
+
+    def get_cache_file(self, ds_name):
+
+        fingerprint = self.get_fingerprint(ds_name)
+        return os.path.join(
+            self.cache_dir,
+            f'{self.get_entry_name(ds_name)}.{fingerprint}.npy')
+
+    def get_entry_name(self, ds_name):
+
+        return ds_name.strip('/').replace('/', '__')
+
+    def get_fingerprint(self, ds_name):
+        '''Hash the metadata and the names, sizes, and modification times of
+        all chunk files of a dataset.'''
+
+        if ds_name in self.fingerprints:
+            return self.fingerprints[ds_name]
+
+        ds_path = os.path.join(self.zarr_path, ds_name)
+        if not os.path.isdir(ds_path):
+            raise RuntimeError(
+                f"{ds_path} is not a directory, only zarr directory stores "
+                "can be cached")
+
+        chunk_stats = []
+        for root, _, files in os.walk(ds_path):
+            for filename in files:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                chunk_stats.append((
+                    os.path.relpath(path, ds_path),
+                    stat.st_size,
+                    stat.st_mtime_ns))
+
+        hasher = hashlib.sha1()
+        for chunk_stat in sorted(chunk_stats):
+            hasher.update(repr(chunk_stat).encode())
+
+        fingerprint = hasher.hexdigest()[:16]
+        self.fingerprints[ds_name] = fingerprint
+
+        return fingerprint
+
+    def remove_stale_entries(self, ds_name, keep=None):
+        '''Remove cached copies of a dataset with an outdated fingerprint.'''
+
+        prefix = os.path.join(self.cache_dir, f'{self.get_entry_name(ds_name)}.')
+        pattern = f'{glob.escape(prefix)}*.npy'
+
+        for path in glob.glob(pattern):
+            # the fingerprint is a hex string, make sure we did not match
+            # another dataset that shares the prefix
+            if '.' in path[len(prefix):-len('.npy')]:
+                continue
+            if path == keep:
+                continue
+            self.remove_entry(path)
+
+    def add_entry(self, path, size):
+
+        self.total_size -= self.entries.pop(path, 0)
+        self.entries[path] = size
+        self.total_size += size
+
+    def remove_entry(self, path):
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # removed by another process in the meantime
+            pass
+        self.total_size -= self.entries.pop(path, 0)
+
+    def scan(self):
+        '''Read all entries of the cache directory, and remove temporary files
+        older than `max_tmp_age`.'''
+
+        now = time.time()
+        entries = []
+
+        for filename in os.listdir(self.cache_dir):
+
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                continue
+
+            if filename.endswith('.tmp'):
+                if now - stat.st_mtime > self.max_tmp_age:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                continue
+
+            if filename.endswith('.npy'):
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+        self.entries = {}
+        self.total_size = 0
+        for _, path, size in sorted(entries):
+            self.add_entry(path, size)
+
+    def evict(self, keep=None):
+        '''Rescan the cache directory and remove least recently used entries
+        until the cache is smaller than 90% of `max_size`, such that the next
+        eviction is not needed right away.'''
+
+        self.scan()
+
+        target_size = 0.9*self.max_size
+
+        for path in list(self.entries.keys()):
+
+            if self.total_size <= target_size:
+                break
+
+            if path == keep:
+                continue
+
+            self.remove_entry(path)
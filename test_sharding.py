@@ -0,0 +1,105 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import extract_features
+from work_queue import WorkQueue
+
+# Checks the sharded extraction with several local processes standing in for
+# worker nodes. Run with `python -m pytest test_sharding.py` or
+# `python test_sharding.py`.
+
+chunk_groups = [
+    f'synapses_{assignment}_{chunk}'
+    for assignment in ['c0', 'c1']
+    for chunk in range(5)
+]
+
+# the worker processing this chunk first dies, without releasing its claim
+crash_chunk_group = 'synapses_c0_3'
+# processing this chunk raises an exception the first time
+fail_chunk_group = 'synapses_c1_1'
+
+timeout = 1
+
+
+def fake_process_chunk(shard_dir, chunk_group):
+
+    marker = f'{shard_dir}/{chunk_group}.attempted'
+    first_attempt = not os.path.exists(marker)
+    open(marker, 'w').close()
+
+    if chunk_group == crash_chunk_group and first_attempt:
+        os._exit(1)
+    if chunk_group == fail_chunk_group and first_attempt:
+        raise RuntimeError("simulated failure")
+
+    # every synapse is annotated twice, by the same chunk number of c0 and c1
+    chunk_number = int(chunk_group.split('_')[-1])
+    return [{
+        'chunk_group': chunk_group,
+        'synapse_id': chunk_number
+    }]
+
+
+def worker(shard_dir):
+
+    extract_features.process_chunk = \
+        lambda zarr_file, chunk_group: fake_process_chunk(shard_dir, chunk_group)
+
+    queue = WorkQueue(f'{shard_dir}/queue.sqlite', timeout, max_attempts=3)
+    queue.add(chunk_groups)
+    extract_features.run_worker(None, queue, shard_dir, poll_interval=0.1)
+
+
+def test_sharded_extraction():
+
+    shard_dir = tempfile.mkdtemp()
+
+    context = multiprocessing.get_context('fork')
+    processes = [
+        context.Process(target=worker, args=(shard_dir,))
+        for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+
+    exit_codes = sorted(process.exitcode for process in processes)
+    assert exit_codes == [0, 0, 1], exit_codes
+
+    queue = WorkQueue(f'{shard_dir}/queue.sqlite', timeout, max_attempts=3)
+    assert queue.get_status() == {'done': len(chunk_groups)}
+
+    synapse_features = extract_features.merge_shards(queue, shard_dir)
+    extract_features.assign_number_to_duplicates(synapse_features)
+
+    assert [s['chunk_group'] for s in synapse_features] == chunk_groups
+
+    for chunk_number in range(5):
+        duplicate_numbers = sorted(
+            s['duplicate_number']
+            for s in synapse_features
+            if s['synapse_id'] == chunk_number)
+        assert duplicate_numbers == [1, 2]
+
+
+def test_merge_empty_queue():
+
+    shard_dir = tempfile.mkdtemp()
+    queue = WorkQueue(f'{shard_dir}/queue.sqlite')
+
+    try:
+        extract_features.merge_shards(queue, shard_dir)
+    except RuntimeError:
+        return
+
+    assert False, "merging an empty queue should fail"
+
+
+if __name__ == "__main__":
+
+    test_sharded_extraction()
+    test_merge_empty_queue()
+    print("ok")
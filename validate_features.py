@@ -0,0 +1,530 @@
+import numpy as np
+import importlib
+import json
+import math
+import numbers
+import os
+import sys
+import time
+import config
+import extract_features
+import check_annotations
+
+# Compare an optimized implementation of the feature functions (the
+# "candidate engine", any module that provides some of the functions below
+# under the same name) against the reference implementation, on a synthetic
+# or a real dataset. Reports mismatches and the speedup for each function.
+
+layer_names = ['raw', 'cleft', 'cleft_membrane', 'cytosol', 'posts', 't-bars',
+               'vesicles']
+
+# functions to compare: name, reference implementation, and how to call it for
+# one synapse group
+functions = [
+    (
+        'agglomerate_intensities (mean)',
+        extract_features.agglomerate_intensities,
+        lambda fun, zarr_file, synapse_group:
+            fun(zarr_file, synapse_group, np.mean)
+    ),
+    (
+        'agglomerate_intensities (median)',
+        extract_features.agglomerate_intensities,
+        lambda fun, zarr_file, synapse_group:
+            fun(zarr_file, synapse_group, np.median)
+    ),
+    (
+        'extract_vesicle_sizes',
+        extract_features.extract_vesicle_sizes,
+        lambda fun, zarr_file, synapse_group:
+            fun(zarr_file, synapse_group)
+    ),
+    (
+        'extract_vesicle_eccentricities',
+        extract_features.extract_vesicle_eccentricities,
+        lambda fun, zarr_file, synapse_group:
+            fun(zarr_file, synapse_group)
+    ),
+    (
+        'get_post_count',
+        extract_features.get_post_count,
+        lambda fun, zarr_file, synapse_group:
+            fun(zarr_file, synapse_group)
+    ),
+    (
+        'has_unique_connected_components',
+        check_annotations.has_unique_connected_components,
+        lambda fun, zarr_file, synapse_group: [
+            fun(zarr_file[f'{synapse_group}/{layer_name}'][:])
+            for layer_name in ['vesicles', 'posts']
+        ]
+    ),
+]
+
+
+def create_synthetic_dataset(num_synapses=20, shape=(29, 64, 64), seed=42):
+    '''Create a dictionary from dataset names to arrays that can be used in
+    place of a zarr container. The synapses cover the special cases of the
+    feature extraction: empty layers, overlapping cleft and cleft membrane,
+    several vesicles in one section, and vesicles that share an ID.'''
+
+    rng = np.random.RandomState(seed)
+    dataset = {}
+
+    def add_box(layer, label):
+        z = rng.randint(0, shape[0])
+        y, x = rng.randint(0, shape[1] - 8), rng.randint(0, shape[2] - 8)
+        h, w = rng.randint(2, 8), rng.randint(2, 8)
+        layer[z, y:y + h, x:x + w] = label
+
+    for synapse in range(num_synapses):
+
+        # ten synapses per chunk, like in the real data
+        synapse_group = f'synapses_c0_{synapse//10}/{synapse%10}'
+        layers = {
+            'raw': rng.randint(0, 256, size=shape).astype(np.uint8)
+        }
+
+        for layer_name in ['cleft_membrane', 'cytosol', 't-bars']:
+            layer = np.zeros(shape, dtype=np.uint64)
+            # some synapses are missing a structure
+            if rng.rand() > 0.2:
+                add_box(layer, 1)
+            layers[layer_name] = layer
+
+        # the cleft lies inside the cleft membrane, which always extends
+        # beyond it (but the cleft can be annotated without a membrane)
+        cleft = np.zeros(shape, dtype=np.uint64)
+        if rng.rand() > 0.2:
+            membrane = np.nonzero(layers['cleft_membrane'])
+            if membrane[0].size > 0:
+                z = membrane[0][0]
+                y, x = membrane[1].min(), membrane[2].min()
+                h, w = membrane[1].max() - y + 1, membrane[2].max() - x + 1
+                cleft[z, y:y + max(h//2, 1), x:x + w] = 1
+                # keep at least one row of membrane only
+                if h == 1:
+                    layers['cleft_membrane'][z, y + 1, x:x + w] = 1
+            else:
+                add_box(cleft, 1)
+        layers['cleft'] = cleft
+
+        posts = np.zeros(shape, dtype=np.uint64)
+        for label in range(1, rng.randint(0, 4) + 1):
+            add_box(posts, label)
+        layers['posts'] = posts
+
+        # vesicles are annotated in a single section, with a few pixels
+        # between them
+        vesicles = np.zeros(shape, dtype=np.uint64)
+        z = rng.randint(0, shape[0])
+        num_vesicles = rng.randint(0, 6)
+        for label in range(1, num_vesicles + 1):
+            y = 10*(label - 1) + 2
+            x = rng.randint(0, shape[2] - 8)
+            h, w = rng.randint(2, 7), rng.randint(2, 7)
+            vesicles[z, y:y + h, x:x + w] = label
+        # sometimes, two separate vesicles share an ID
+        if num_vesicles > 1 and rng.rand() < 0.2:
+            vesicles[vesicles == num_vesicles] = 1
+        layers['vesicles'] = vesicles
+
+        for layer_name, layer in layers.items():
+            dataset[f'{synapse_group}/{layer_name}'] = layer
+
+    return dataset
+
+
+def get_synapse_groups(zarr_file, chunk_groups):
+
+    return [
+        f'{chunk_group}/{synapse}'
+        for chunk_group in chunk_groups
+        for synapse in range(10)
+        if f'{chunk_group}/{synapse}/raw' in zarr_file
+    ]
+
+
+def load_synapse_groups(zarr_file, synapse_groups):
+    '''Read all layers of the given synapse groups into a dictionary that can
+    be used in place of a zarr container, such that reading and decompressing
+    the data is not part of the timing.'''
+
+    return {
+        f'{synapse_group}/{layer_name}':
+            np.asarray(zarr_file[f'{synapse_group}/{layer_name}'][:])
+        for synapse_group in synapse_groups
+        for layer_name in layer_names
+    }
+
+
+def is_number(value):
+
+    return isinstance(value, (numbers.Real, np.bool_))
+
+
+def get_sort_key(value):
+    '''Sort key for the values of unordered lists: numbers by value, `None`
+    and values of other types after them.'''
+
+    if is_number(value):
+        return (0, float(value), '')
+    if value is None:
+        return (1, 0.0, '')
+    return (2, 0.0, repr(value))
+
+
+def compare_values(reference, candidate, rtol, atol, path='',
+                   unordered_fields=()):
+    '''Compare two (possibly nested) feature values. Returns a list of
+    mismatches, as strings.'''
+
+    if reference is None or candidate is None:
+        if reference is None and candidate is None:
+            return []
+        return [f"{path}: {reference!r} != {candidate!r}"]
+
+    if isinstance(reference, dict):
+        if not isinstance(candidate, dict):
+            return [f"{path}: expected dict, got {candidate!r}"]
+        mismatches = []
+        for key in sorted(set(reference) | set(candidate), key=str):
+            if key not in candidate:
+                mismatches.append(f"{path}/{key}: missing")
+            elif key not in reference:
+                mismatches.append(f"{path}/{key}: unexpected")
+            else:
+                mismatches += compare_values(
+                    reference[key],
+                    candidate[key],
+                    rtol,
+                    atol,
+                    f"{path}/{key}",
+                    unordered_fields)
+        return mismatches
+
+    if isinstance(reference, (list, tuple, np.ndarray)):
+        if not isinstance(candidate, (list, tuple, np.ndarray)):
+            return [f"{path}: expected list, got {candidate!r}"]
+        if len(reference) != len(candidate):
+            return [
+                f"{path}: length {len(reference)} != {len(candidate)}"]
+        if path.split('/')[-1] in unordered_fields:
+            reference = sorted(reference, key=get_sort_key)
+            candidate = sorted(candidate, key=get_sort_key)
+        mismatches = []
+        for i, (r, c) in enumerate(zip(reference, candidate)):
+            mismatches += compare_values(
+                r, c, rtol, atol, f"{path}[{i}]", unordered_fields)
+        return mismatches
+
+    if isinstance(reference, str) or isinstance(candidate, str):
+        if reference != candidate:
+            return [f"{path}: {reference!r} != {candidate!r}"]
+        return []
+
+    if not is_number(reference) or not is_number(candidate):
+        return [f"{path}: type mismatch, {reference!r} != {candidate!r}"]
+
+    if isinstance(reference, (bool, np.bool_)) or \
+            isinstance(candidate, (bool, np.bool_)):
+        if bool(reference) != bool(candidate):
+            return [f"{path}: {reference!r} != {candidate!r}"]
+        return []
+
+    # numbers
+    if math.isnan(reference) and math.isnan(candidate):
+        return []
+    if not math.isclose(reference, candidate, rel_tol=rtol, abs_tol=atol):
+        return [f"{path}: {reference!r} != {candidate!r}"]
+
+    return []
+
+
+def compare_records(reference, candidate, rtol, atol, unordered_fields=()):
+    '''Compare two lists of synapse feature records (as created by
+    `extract_features.py`) field by field, including `duplicate_number`.
+    Returns a list of mismatches, as strings.'''
+
+    def get_key(record):
+        # records without these fields are reported as unexpected
+        return (
+            record.get('assignment'),
+            record.get('chunk_number'),
+            record.get('synapse_number'))
+
+    reference_keys = [get_key(r) for r in reference]
+    candidate_keys = [get_key(r) for r in candidate]
+
+    mismatches = []
+
+    if set(reference_keys) == set(candidate_keys) and \
+            reference_keys != candidate_keys:
+        mismatches.append("records are in a different order")
+
+    candidate_records = dict(zip(candidate_keys, candidate))
+
+    for key, record in zip(reference_keys, reference):
+        name = '_'.join(str(k) for k in key)
+        if key not in candidate_records:
+            mismatches.append(f"{name}: missing")
+            continue
+        mismatches += compare_values(
+            record,
+            candidate_records[key],
+            rtol,
+            atol,
+            name,
+            unordered_fields)
+
+    for key in set(candidate_keys) - set(reference_keys):
+        mismatches.append(f"{'_'.join(str(k) for k in key)}: unexpected")
+
+    return mismatches
+
+
+def run_function(fun, call, zarr_file, synapse_groups):
+    '''Run a function on all synapse groups. Returns the results and the
+    time it took.'''
+
+    start = time.perf_counter()
+    results = [
+        call(fun, zarr_file, synapse_group)
+        for synapse_group in synapse_groups
+    ]
+    elapsed = time.perf_counter() - start
+
+    return results, elapsed
+
+
+def time_functions(reference_fun, candidate_fun, call, zarr_file,
+                   synapse_groups, repeat):
+    '''Run the reference and candidate function `repeat` times on all synapse
+    groups, alternating which one goes first. Returns the best time of each.
+
+    Both functions are run once on all synapse groups before, such that lazy
+    imports and caches (also of the data) are not part of the timing.'''
+
+    run_function(reference_fun, call, zarr_file, synapse_groups)
+    run_function(candidate_fun, call, zarr_file, synapse_groups)
+
+    reference_times = []
+    candidate_times = []
+
+    for i in range(repeat):
+        if i % 2 == 0:
+            reference_times.append(run_function(
+                reference_fun, call, zarr_file, synapse_groups)[1])
+            candidate_times.append(run_function(
+                candidate_fun, call, zarr_file, synapse_groups)[1])
+        else:
+            candidate_times.append(run_function(
+                candidate_fun, call, zarr_file, synapse_groups)[1])
+            reference_times.append(run_function(
+                reference_fun, call, zarr_file, synapse_groups)[1])
+
+    return min(reference_times), min(candidate_times)
+
+
+def validate_engine(engine, zarr_file, synapse_groups, rtol, atol, repeat,
+                    unordered_fields=()):
+    '''Compare all functions provided by `engine` against the reference
+    implementations. Returns the total number of mismatches.'''
+
+    total_mismatches = 0
+
+    for name, reference_fun, call in functions:
+
+        fun_name = name.split(' ')[0]
+        if not hasattr(engine, fun_name):
+            print(f"{name}: not provided by {engine.__name__}, skipped")
+            continue
+        candidate_fun = getattr(engine, fun_name)
+
+        reference_results = [
+            call(reference_fun, zarr_file, synapse_group)
+            for synapse_group in synapse_groups
+        ]
+
+        # the candidate may fail, report this as a mismatch
+        errors = []
+        candidate_results = []
+        for synapse_group in synapse_groups:
+            try:
+                candidate_results.append(
+                    call(candidate_fun, zarr_file, synapse_group))
+            except Exception as e:
+                errors.append(f"{synapse_group}: raised {e!r}")
+                candidate_results.append(None)
+
+        if errors:
+            print(f"{name}: {len(errors)} errors, not timed")
+            for error in errors:
+                print(f"  {error}")
+            total_mismatches += len(errors)
+            continue
+
+        reference_time, candidate_time = time_functions(
+            reference_fun,
+            candidate_fun,
+            call,
+            zarr_file,
+            synapse_groups,
+            repeat)
+
+        mismatches = []
+        for synapse_group, r, c in zip(
+                synapse_groups,
+                reference_results,
+                candidate_results):
+            mismatches += compare_values(
+                r, c, rtol, atol, synapse_group, unordered_fields)
+
+        speedup = reference_time/candidate_time if candidate_time > 0 \
+            else math.inf
+
+        print(f"{name}: {len(mismatches)} mismatches, "
+              f"reference {reference_time:.3f}s, "
+              f"candidate {candidate_time:.3f}s, "
+              f"speedup {speedup:.2f}x")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+
+        total_mismatches += len(mismatches)
+
+    return total_mismatches
+
+
+if __name__ == "__main__":
+
+    parser = config.create_parser(
+        "Validate an optimized implementation of the feature functions "
+        "against the reference implementation.")
+    parser.add_argument(
+        '--engine',
+        help="module with optimized versions of (some of) the feature "
+             "functions, e.g., 'fast_features'")
+    parser.add_argument(
+        '--synthetic',
+        type=int,
+        metavar='NUM_SYNAPSES',
+        help="validate on a synthetic dataset with this many synapses, "
+             "instead of --dataset")
+    parser.add_argument(
+        '--reference-json',
+        help="features extracted with the reference implementation")
+    parser.add_argument(
+        '--candidate-json',
+        help="features extracted with the optimized implementation, compared "
+             "against --reference-json")
+    parser.add_argument(
+        '--rtol',
+        type=float,
+        default=1e-9,
+        help="relative tolerance for numbers")
+    parser.add_argument(
+        '--atol',
+        type=float,
+        default=0.0,
+        help="absolute tolerance for numbers")
+    parser.add_argument(
+        '--unordered',
+        nargs='*',
+        default=[],
+        help="list-valued features whose order does not matter, e.g., "
+             "vesicle_sizes")
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help="run each function this many times, report the best time")
+    parser.add_argument(
+        '--no-preload',
+        action='store_true',
+        help="read the layers from the dataset during the comparison, "
+             "instead of loading all of them into memory first (the timing "
+             "then includes reading and decompressing the data)")
+    args = config.parse_config(parser)
+
+    # make sure that a mistyped command does not pass without checking
+    # anything
+    if args.synthetic is not None and args.engine is None:
+        parser.error("--synthetic requires --engine")
+    compare_json = \
+        args.reference_json is not None or args.candidate_json is not None
+    if args.engine is None and not compare_json:
+        parser.error(
+            "nothing to validate, give --engine and/or --reference-json and "
+            "--candidate-json")
+    if compare_json and (
+            args.reference_json is None or args.candidate_json is None):
+        parser.error("--reference-json and --candidate-json require each other")
+    for filename in [args.reference_json, args.candidate_json]:
+        if filename is not None and not os.path.exists(filename):
+            parser.error(f"{filename} does not exist")
+
+    total_mismatches = 0
+
+    if args.engine is not None:
+
+        engine = importlib.import_module(args.engine)
+
+        if not any(
+                hasattr(engine, name.split(' ')[0])
+                for name, _, _ in functions):
+            parser.error(
+                f"{args.engine} does not provide any of the feature functions")
+
+        if args.synthetic is not None:
+            zarr_file = create_synthetic_dataset(args.synthetic)
+            chunk_groups = sorted(
+                set(ds_name.split('/')[0] for ds_name in zarr_file),
+                key=lambda c: int(c.split('_')[-1]))
+        else:
+            zarr_file = config.open_dataset(args)
+            chunk_groups = extract_features.get_chunk_groups(
+                zarr_file,
+                args.assignments,
+                args.max_num_chunks)
+
+        synapse_groups = get_synapse_groups(zarr_file, chunk_groups)
+        if not synapse_groups:
+            parser.error("no synapses found in the dataset")
+
+        if args.synthetic is None and not args.no_preload:
+            print(f"Loading {len(synapse_groups)} synapses...")
+            zarr_file = load_synapse_groups(zarr_file, synapse_groups)
+
+        print(f"Validating {args.engine} on {len(synapse_groups)} synapses...")
+
+        total_mismatches += validate_engine(
+            engine,
+            zarr_file,
+            synapse_groups,
+            args.rtol,
+            args.atol,
+            args.repeat,
+            args.unordered)
+
+    if compare_json:
+
+        with open(args.reference_json, 'r') as f:
+            reference = json.load(f)
+        with open(args.candidate_json, 'r') as f:
+            candidate = json.load(f)
+
+        mismatches = compare_records(
+            reference,
+            candidate,
+            args.rtol,
+            args.atol,
+            args.unordered)
+
+        print(f"{args.candidate_json}: {len(mismatches)} mismatches")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+
+        total_mismatches += len(mismatches)
+
+    if total_mismatches > 0:
+        sys.exit(1)
@@ -0,0 +1,208 @@
+import os
+import socket
+import sqlite3
+import time
+
+
+class WorkQueue:
+    '''A work queue of chunk groups, stored in an SQLite database.
+
+    Several workers (processes on the same or on different machines sharing a
+    filesystem) can open the same queue and claim chunk groups from it. A
+    claimed chunk group that has not been marked as done after `timeout`
+    seconds (e.g., because the worker crashed) is handed out again. Chunk
+    groups that failed `max_attempts` times are not handed out anymore.
+
+    Note that SQLite relies on file locking, which has to be supported by the
+    shared filesystem.
+
+    Args:
+
+        db_file (string):
+
+            The SQLite database to store the queue in, will be created if it
+            does not exist.
+
+        timeout (float, optional):
+
+            Seconds after which a claimed chunk group is considered lost.
+
+        max_attempts (int, optional):
+
+            How often to try each chunk group before giving up.
+    '''
+
+    def __init__(self, db_file, timeout=3600, max_attempts=3):
+
+        self.db_file = db_file
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+        # autocommit mode, transactions are started explicitly
+        self.connection = sqlite3.connect(
+            db_file,
+            timeout=60,
+            isolation_level=None)
+
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_groups (
+                chunk_group TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                claimed_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )''')
+
+    def add(self, chunk_groups):
+        '''Add chunk groups to the queue. Chunk groups that are already in the
+        queue are ignored, such that all workers can call this on startup.
+
+        The order of `chunk_groups` is the canonical order used by
+        `get_done`.'''
+
+        with self.transaction():
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO chunk_groups (chunk_group, position) '
+                'VALUES (?, ?)',
+                [(c, i) for i, c in enumerate(chunk_groups)])
+
+    def claim(self):
+        '''Claim the next chunk group to process. Returns `None` if there is
+        nothing left to claim.'''
+
+        now = time.time()
+
+        with self.transaction():
+
+            # give up on lost chunk groups that have been tried too often
+            self.connection.execute(
+                '''UPDATE chunk_groups SET status = 'failed',
+                    error = COALESCE(error, 'timed out')
+                WHERE status = 'claimed' AND claimed_at < ? AND attempts >= ?''',
+                (now - self.timeout, self.max_attempts))
+
+            row = self.connection.execute(
+                '''SELECT chunk_group FROM chunk_groups
+                WHERE attempts < ? AND (
+                    status = 'pending' OR
+                    (status = 'claimed' AND claimed_at < ?))
+                ORDER BY position
+                LIMIT 1''',
+                (self.max_attempts, now - self.timeout)).fetchone()
+
+            if row is None:
+                return None
+
+            chunk_group = row[0]
+            self.connection.execute(
+                '''UPDATE chunk_groups
+                SET status = 'claimed', worker = ?, claimed_at = ?,
+                    attempts = attempts + 1
+                WHERE chunk_group = ?''',
+                (self.worker_id, now, chunk_group))
+
+        return chunk_group
+
+    def done(self, chunk_group):
+
+        with self.transaction():
+            self.connection.execute(
+                '''UPDATE chunk_groups SET status = 'done', error = NULL
+                WHERE chunk_group = ?''',
+                (chunk_group,))
+
+    def failed(self, chunk_group, error):
+        '''Release a chunk group after a failure, such that it can be retried
+        (unless it has been tried `max_attempts` times already).'''
+
+        with self.transaction():
+            self.connection.execute(
+                '''UPDATE chunk_groups
+                SET status = CASE WHEN attempts < ? THEN 'pending'
+                    ELSE 'failed' END,
+                    error = ?
+                WHERE chunk_group = ? AND status = 'claimed' AND worker = ?''',
+                (self.max_attempts, str(error), chunk_group, self.worker_id))
+
+    def get_wait_time(self):
+        '''Get the number of seconds until there might be a chunk group to
+        claim: 0 if there are pending chunk groups, the time until the oldest
+        claim expires if there are claimed chunk groups, and `None` if all
+        chunk groups are done or failed.'''
+
+        pending = self.connection.execute(
+            '''SELECT COUNT(*) FROM chunk_groups
+            WHERE status = 'pending' AND attempts < ?''',
+            (self.max_attempts,)).fetchone()[0]
+
+        if pending > 0:
+            return 0
+
+        oldest_claim = self.connection.execute(
+            '''SELECT MIN(claimed_at) FROM chunk_groups
+            WHERE status = 'claimed' ''').fetchone()[0]
+
+        if oldest_claim is None:
+            return None
+
+        return max(0, oldest_claim + self.timeout - time.time())
+
+    def get_status(self):
+        '''Get a dictionary from status ("pending", "claimed", "done",
+        "failed") to the number of chunk groups with this status.'''
+
+        rows = self.connection.execute(
+            'SELECT status, COUNT(*) FROM chunk_groups GROUP BY status')
+
+        return dict(rows.fetchall())
+
+    def get_done(self):
+        '''Get all chunk groups in canonical order, if all of them are done.
+        Returns `None` otherwise, or if the queue is empty.'''
+
+        rows = self.connection.execute(
+            'SELECT chunk_group, status FROM chunk_groups '
+            'ORDER BY position').fetchall()
+
+        if not rows:
+            return None
+
+        if any(status != 'done' for _, status in rows):
+            return None
+
+        return [chunk_group for chunk_group, _ in rows]
+
+    def get_errors(self):
+
+        rows = self.connection.execute(
+            'SELECT chunk_group, error FROM chunk_groups '
+            'WHERE error IS NOT NULL ORDER BY position')
+
+        return rows.fetchall()
+
+    def transaction(self):
+
+        return Transaction(self.connection)
+
+
+class Transaction:
+    '''Context manager for an exclusive transaction, such that no two workers
+    can claim the same chunk group.'''
+
+    def __init__(self, connection):
+
+        self.connection = connection
+
+    def __enter__(self):
+
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')